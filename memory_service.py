@@ -378,6 +378,8 @@ class MemoryService:
             )
             msgs = [r["message"] for r in cur.fetchall()]
             if not msgs:
+                self._mark_consolidated(cur, user_key)
+                conn.commit()
                 return None
             summary = None
             if llm_fn:
@@ -399,12 +401,16 @@ class MemoryService:
                 top = ", ".join(t for t, _ in topics.most_common(6))
                 summary = f"Usuario con interés recurrente en: {top}." if top else None
             if summary:
+                self._ensure_consolidation_column()
                 cur.execute(
                     "UPDATE mem_profiles SET summary = %s, updated_at = now()"
-                    " WHERE user_key = %s",
+                    + (", summarized_interactions = interactions" if self._consol_col_ok else "")
+                    + " WHERE user_key = %s",
                     (summary, user_key),
                 )
-                conn.commit()
+            else:
+                self._mark_consolidated(cur, user_key)
+            conn.commit()
             return summary
         except Exception as exc:  # noqa: BLE001
             conn.rollback()
@@ -413,6 +419,183 @@ class MemoryService:
         finally:
             conn.close()
 
+    # ── batch consolidation (FASE 31.58) ─────────────────────────────────
+    # The daily job used to call consolidate_profile() once per active user,
+    # each with its own full LLM cascade: one slow provider stretched the run
+    # to tens of minutes. The batch path below packs several users into ONE
+    # prompt with a JSON answer, and only touches profiles whose interaction
+    # counter moved since their last summary. Progress lives in the profile
+    # row itself (summarized_interactions), so a run cut short by its budget
+    # resumes naturally on the next one.
+    _consol_col_ok = False
+
+    def _ensure_consolidation_column(self) -> bool:
+        if self._consol_col_ok:
+            return True
+        conn, cur = self._conn(admin=True)
+        try:
+            cur.execute("ALTER TABLE mem_profiles ADD COLUMN IF NOT EXISTS"
+                        " summarized_interactions INT DEFAULT 0")
+            conn.commit()
+            self._consol_col_ok = True
+        except Exception as exc:  # noqa: BLE001
+            conn.rollback()
+            logger.debug("summarized_interactions column unavailable: %s", exc)
+        finally:
+            conn.close()
+        return self._consol_col_ok
+
+    def _mark_consolidated(self, cur, user_key: str) -> None:
+        """Nothing to summarize: advance the counter so the profile leaves
+        the pending queue until new messages arrive."""
+        if self._ensure_consolidation_column():
+            cur.execute(
+                "UPDATE mem_profiles SET summarized_interactions = interactions"
+                " WHERE user_key = %s",
+                (user_key,),
+            )
+
+    def pending_consolidation(self, limit: int = 120) -> dict:
+        """{user_key: interactions} for profiles with new messages since the
+        last summary, most recently active first."""
+        if not self._ensure_consolidation_column():
+            return {k: None for k in self.active_user_keys(24, limit)}
+        conn, cur = self._conn(admin=True)
+        try:
+            cur.execute(
+                "SELECT user_key, interactions FROM mem_profiles"
+                " WHERE interactions > COALESCE(summarized_interactions, 0)"
+                " ORDER BY updated_at DESC LIMIT %s",
+                (limit,),
+            )
+            return {r["user_key"]: r["interactions"] for r in cur.fetchall()}
+        except Exception as exc:  # noqa: BLE001
+            logger.debug("pending_consolidation failed: %s", exc)
+            return {}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _parse_batch_json(raw: str) -> dict:
+        """Tolerant JSON extraction: LLMs like to wrap JSON in prose/fences."""
+        if not raw:
+            return {}
+        m = re.search(r"\{.*\}", raw, re.S)
+        if not m:
+            return {}
+        try:
+            data = json.loads(m.group(0))
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def batch_prompt(self, user_keys: list, per_user: int = 25) -> tuple:
+        """Build the packed prompt. Returns (prompt, {alias: user_key},
+        {user_key: [messages]}). Aliases keep user keys out of the LLM."""
+        conn, cur = self._conn(admin=True)
+        try:
+            cur.execute(
+                """
+                SELECT user_key, message FROM (
+                    SELECT user_key, message, row_number() OVER (
+                        PARTITION BY user_key ORDER BY created_at DESC) AS rn
+                    FROM mem_conversations
+                    WHERE role = 'user' AND user_key = ANY(%s)
+                ) t WHERE rn <= %s
+                """,
+                (list(user_keys), per_user),
+            )
+            msgs: dict = {}
+            for r in cur.fetchall():
+                msgs.setdefault(r["user_key"], []).append(r["message"])
+        finally:
+            conn.close()
+        aliases = {f"u{i + 1}": uk for i, uk in enumerate(k for k in user_keys if msgs.get(k))}
+        bloques = [
+            f"[{alias}]\n- " + "\n- ".join(m[:200] for m in msgs[uk])
+            for alias, uk in aliases.items()
+        ]
+        prompt = (
+            "Para CADA usuario listado abajo, resume en 3-4 líneas su perfil "
+            "para personalizar futuras respuestas: intereses, tono con que "
+            "escribe, y datos personales/profesionales que él mismo haya "
+            "mencionado. Sin inventar nada. Responde SOLO con un objeto JSON "
+            "cuyas claves sean los identificadores entre corchetes y cuyos "
+            'valores sean el resumen, por ejemplo {"u1": "...", "u2": "..."}.'
+            "\n\n" + "\n\n".join(bloques)
+        )
+        return prompt, aliases, msgs
+
+    def consolidate_profiles_batch(self, user_keys: list, llm_fn=None,
+                                   interactions: dict | None = None) -> dict:
+        """Summarize several users with ONE llm_fn call; users the LLM left
+        out get the heuristic summary. Returns {user_key: summary}."""
+        if not user_keys:
+            return {}
+        try:
+            prompt, aliases, msgs = self.batch_prompt(user_keys)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("consolidate_profiles_batch read failed: %s", exc)
+            return {}
+        parsed: dict = {}
+        if llm_fn and aliases:
+            try:
+                parsed = self._parse_batch_json(llm_fn(prompt))
+            except Exception as exc:  # noqa: BLE001
+                logger.debug("llm_fn failed in consolidate_profiles_batch: %s", exc)
+        out: dict = {}
+        for alias, uk in aliases.items():
+            summary = str(parsed.get(alias) or "").strip()[:800] or None
+            if not summary:
+                topics = Counter()
+                for m in msgs[uk]:
+                    topics.update(self._extract_topics(m))
+                top = ", ".join(t for t, _ in topics.most_common(6))
+                summary = f"Usuario con interés recurrente en: {top}." if top else None
+            if summary:
+                out[uk] = summary
+        interactions = interactions or {}
+        col = self._ensure_consolidation_column()
+        # Selected profiles with nothing to summarize (no user messages, or
+        # no topics either) are still marked as processed; otherwise they
+        # would be picked up again on every run.
+        vacios = [uk for uk in user_keys if uk not in out]
+        if not out and not (col and vacios):
+            return out
+        conn, cur = self._conn(admin=True)
+        try:
+            if col:
+                for uk in vacios:
+                    cur.execute(
+                        "UPDATE mem_profiles SET summarized_interactions ="
+                        " COALESCE(%s, interactions) WHERE user_key = %s",
+                        (interactions.get(uk), uk),
+                    )
+            for uk, summary in out.items():
+                if col:
+                    # Snapshot taken at selection time: messages that arrive
+                    # mid-run keep the profile pending for the next run.
+                    cur.execute(
+                        "UPDATE mem_profiles SET summary = %s, updated_at = now(),"
+                        " summarized_interactions = COALESCE(%s, interactions)"
+                        " WHERE user_key = %s",
+                        (summary, interactions.get(uk), uk),
+                    )
+                else:
+                    cur.execute(
+                        "UPDATE mem_profiles SET summary = %s, updated_at = now()"
+                        " WHERE user_key = %s",
+                        (summary, uk),
+                    )
+            conn.commit()
+        except Exception as exc:  # noqa: BLE001
+            conn.rollback()
+            logger.warning("consolidate_profiles_batch write failed: %s", exc)
+            return {}
+        finally:
+            conn.close()
+        return out
+
     # ─────────────────────────────────────────────────────────────────────
     # 4. LEARNING — mine FAQs into PENDING KB entries (never auto-approved)
     # ─────────────────────────────────────────────────────────────────────